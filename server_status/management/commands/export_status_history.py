@@ -0,0 +1,94 @@
+"""
+Export recorded status history as CSV or JSON.
+"""
+from __future__ import unicode_literals
+import calendar
+import csv
+from datetime import datetime
+import io
+import json
+import os
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from server_status.recorder import (
+    MINUTE,
+    RAW,
+    RAW_FIELDS,
+    RESOLUTIONS,
+    ROLLUP_FIELDS,
+    StatusRecorder,
+)
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def parse_time(value):
+    """Convert a UTC timestamp like 2020-09-18T12:00:00 to epoch seconds."""
+    try:
+        return calendar.timegm(datetime.strptime(value, TIME_FORMAT).timetuple())
+    except ValueError:
+        raise CommandError(
+            "Invalid time %r, expected YYYY-MM-DDTHH:MM:SS (UTC)" % value
+        )
+
+
+class Command(BaseCommand):
+    """Export recorded status history"""
+    help = "Export status history recorded in STATUS_HISTORY_DB"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--resolution', choices=RESOLUTIONS, default=MINUTE,
+            help="Raw samples or 1-minute/1-hour rollups (default: minute)",
+        )
+        parser.add_argument('--service', help="Only export this service")
+        parser.add_argument(
+            '--since', help="Start of the range, inclusive (UTC)",
+        )
+        parser.add_argument(
+            '--until', help="End of the range, exclusive (UTC)",
+        )
+        parser.add_argument(
+            '--format', choices=('csv', 'json'), default='csv',
+            dest='output_format',
+        )
+
+    def handle(self, *args, **options):
+        path = getattr(settings, 'STATUS_HISTORY_DB', None)
+        if not path:
+            raise CommandError("STATUS_HISTORY_DB is not configured.")
+        if not os.path.exists(path):
+            raise CommandError("No status history found at %s." % path)
+
+        recorder = StatusRecorder(path, read_only=True)
+        try:
+            rows = recorder.query(
+                resolution=options['resolution'],
+                service=options['service'],
+                start=parse_time(options['since']) if options['since'] else None,
+                end=parse_time(options['until']) if options['until'] else None,
+            )
+        except sqlite3.Error as ex:
+            raise CommandError("Error reading status history: %s" % ex)
+        finally:
+            recorder.stop()
+
+        for row in rows:
+            row['time'] = datetime.utcfromtimestamp(row['time']).strftime(
+                TIME_FORMAT if options['resolution'] != RAW
+                else TIME_FORMAT + '.%f'
+            )
+
+        if options['output_format'] == 'json':
+            self.stdout.write(json.dumps(rows, indent=2))
+        else:
+            output = io.StringIO()
+            writer = csv.DictWriter(output, fieldnames=(
+                RAW_FIELDS if options['resolution'] == RAW else ROLLUP_FIELDS
+            ))
+            writer.writeheader()
+            writer.writerows(rows)
+            self.stdout.write(output.getvalue(), ending='')
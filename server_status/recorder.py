@@ -0,0 +1,379 @@
+"""
+Status history recorder
+
+Notes:
+
+* Recording is optional and only enabled when STATUS_HISTORY_DB is set to
+  the path of a SQLite file.
+* Results are queued in memory by ``record`` and written in batches by a
+  background thread, so recording never blocks the status view. If the
+  queue is full, results are dropped and a warning is logged.
+* Every batch is written as raw samples and folded into 1-minute and
+  1-hour rollups. Each resolution is pruned according to
+  STATUS_HISTORY_RETENTION (seconds).
+* The recorder is stopped at interpreter exit, which flushes anything
+  still queued.
+"""
+from __future__ import unicode_literals
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+RAW = "raw"
+MINUTE = "minute"
+HOUR = "hour"
+RESOLUTIONS = (RAW, MINUTE, HOUR)
+ROLLUP_SECONDS = {MINUTE: 60, HOUR: 3600}
+RAW_FIELDS = ("time", "service", "status", "response_microseconds")
+ROLLUP_FIELDS = (
+    "time", "service", "samples", "down", "response_microseconds_avg",
+    "response_microseconds_min", "response_microseconds_max",
+)
+STATUS_ALL = "status_all"
+DOWN = "down"
+
+DEFAULT_RETENTION = {
+    RAW: 24 * 3600,
+    MINUTE: 7 * 24 * 3600,
+    HOUR: 365 * 24 * 3600,
+}
+DEFAULT_FLUSH_SECONDS = 10
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_QUEUE = 10000
+TIMEOUT_SECONDS = 5
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS status_sample (
+        time REAL NOT NULL,
+        service TEXT NOT NULL,
+        status TEXT NOT NULL,
+        response_microseconds INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS status_sample_time ON status_sample (time)",
+    """
+    CREATE TABLE IF NOT EXISTS status_rollup (
+        resolution TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        service TEXT NOT NULL,
+        samples INTEGER NOT NULL,
+        down INTEGER NOT NULL,
+        latency_samples INTEGER NOT NULL,
+        latency_total INTEGER NOT NULL,
+        latency_min INTEGER,
+        latency_max INTEGER,
+        PRIMARY KEY (resolution, bucket, service)
+    )
+    """,
+)
+
+# Rollups are merged with INSERT OR IGNORE followed by UPDATE rather than
+# an upsert, which needs SQLite 3.24 or newer.
+INSERT_ROLLUP = """
+    INSERT OR IGNORE INTO status_rollup VALUES (?, ?, ?, 0, 0, 0, 0, NULL, NULL)
+"""
+
+UPDATE_ROLLUP = """
+    UPDATE status_rollup SET
+        samples = samples + ?,
+        down = down + ?,
+        latency_samples = latency_samples + ?,
+        latency_total = latency_total + ?,
+        latency_min = min(coalesce(latency_min, ?), coalesce(?, latency_min)),
+        latency_max = max(coalesce(latency_max, ?), coalesce(?, latency_max))
+    WHERE resolution = ? AND bucket = ? AND service = ?
+"""
+
+
+def _merge(aggregate, status, micro):
+    """Fold one sample into a rollup row [samples, down, n, total, min, max]."""
+    aggregate[0] += 1
+    if status == DOWN:
+        aggregate[1] += 1
+    if micro is not None:
+        aggregate[2] += 1
+        aggregate[3] += micro
+        aggregate[4] = micro if aggregate[4] is None else min(aggregate[4], micro)
+        aggregate[5] = micro if aggregate[5] is None else max(aggregate[5], micro)
+
+
+def _update_params(key, aggregate):
+    """Parameters for UPDATE_ROLLUP from a rollup key and its aggregate."""
+    count, down, latency_count, latency_total, latency_min, latency_max = aggregate
+    return (
+        count, down, latency_count, latency_total,
+        latency_min, latency_min, latency_max, latency_max,
+    ) + key
+
+
+class StatusRecorder:  # pylint: disable=too-many-instance-attributes
+    """Batch check results into a SQLite file off the request path."""
+
+    def __init__(self, path,  # pylint: disable=too-many-arguments
+                 flush_seconds=DEFAULT_FLUSH_SECONDS,
+                 batch_size=DEFAULT_BATCH_SIZE, max_queue=DEFAULT_MAX_QUEUE,
+                 retention=None, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.retention = dict(DEFAULT_RETENTION, **(retention or {}))
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._record_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._connection = None
+
+    def record(self, info, timestamp=None):
+        """
+        Queue the results of one status call. Never blocks: if the writer
+        has fallen too far behind, the whole call is dropped so that no
+        partial results are stored.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        samples = []
+        for key, value in info.items():
+            if isinstance(value, dict):
+                samples.append((timestamp, key, value.get("status"),
+                                value.get("response_microseconds")))
+            elif key == STATUS_ALL:
+                samples.append((timestamp, key, value, None))
+        # Everything that adds to the queue holds _record_lock, so once there
+        # is room for every sample none of the puts below can fail.
+        with self._record_lock:
+            if self._queue.maxsize - self._queue.qsize() < len(samples):
+                log.warning("Status history queue is full, dropping results.")
+                return
+            for sample in samples:
+                self._queue.put_nowait(sample)
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        """Start the background writer thread."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="server-status-recorder",
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background writer, flushing anything still queued."""
+        if self._thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _run(self):
+        """Flush periodically, or early once a full batch is queued."""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as ex:
+                log.error("Error writing status history: %s", ex)
+        try:
+            self.flush()
+        except sqlite3.Error as ex:
+            log.error("Error writing status history: %s", ex)
+
+    def _connect(self):
+        """
+        Open a connection and make sure the schema exists. Read-only
+        connections leave the file untouched and fail if it does not exist.
+        """
+        if self.read_only:
+            return sqlite3.connect(
+                'file:%s?mode=ro' % quote(self.path), uri=True,
+                timeout=TIMEOUT_SECONDS, check_same_thread=False,
+            )
+        connection = sqlite3.connect(
+            self.path, timeout=TIMEOUT_SECONDS, check_same_thread=False,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+        return connection
+
+    def flush(self, now=None):
+        """
+        Write everything queued so far in transactions of at most
+        ``batch_size`` samples, updating the rollups and pruning expired
+        rows. Returns the number of samples written.
+
+        If a batch cannot be written it is put back on the queue, so it is
+        retried on the next flush, and the error is re-raised.
+        """
+        written = 0
+        while True:
+            samples = []
+            while len(samples) < self.batch_size:
+                try:
+                    samples.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not samples:
+                return written
+            try:
+                self._write(samples, now)
+            except sqlite3.Error:
+                self._requeue(samples)
+                raise
+            written += len(samples)
+
+    def _requeue(self, samples):
+        """Put back samples that could not be written, dropping any overflow."""
+        dropped = 0
+        with self._record_lock:
+            for sample in samples:
+                try:
+                    self._queue.put_nowait(sample)
+                except queue.Full:
+                    dropped += 1
+        if dropped:
+            log.warning(
+                "Status history queue is full, dropped %d unwritten samples.",
+                dropped,
+            )
+
+    def _write(self, samples, now=None):
+        """Write one batch of samples and its rollups in a single transaction."""
+        rollups = {}
+        for timestamp, service, status, micro in samples:
+            for resolution, seconds in ROLLUP_SECONDS.items():
+                bucket = int(timestamp // seconds * seconds)
+                aggregate = rollups.setdefault(
+                    (resolution, bucket, service), [0, 0, 0, 0, None, None],
+                )
+                _merge(aggregate, status, micro)
+
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT INTO status_sample VALUES (?, ?, ?, ?)", samples,
+                )
+                self._connection.executemany(INSERT_ROLLUP, list(rollups))
+                self._connection.executemany(UPDATE_ROLLUP, [
+                    _update_params(key, aggregate)
+                    for key, aggregate in rollups.items()
+                ])
+                self._prune(self._connection, now)
+
+    def _prune(self, connection, now=None):
+        """Delete rows older than the retention for their resolution."""
+        now = time.time() if now is None else now
+        connection.execute(
+            "DELETE FROM status_sample WHERE time < ?",
+            (now - self.retention[RAW],),
+        )
+        for resolution in ROLLUP_SECONDS:
+            connection.execute(
+                "DELETE FROM status_rollup WHERE resolution = ? AND bucket < ?",
+                (resolution, now - self.retention[resolution]),
+            )
+
+    def query(self, resolution=MINUTE, service=None, start=None, end=None):
+        """
+        Return recorded history as a list of dicts ordered by time.
+        ``start`` and ``end`` are epoch seconds; ``end`` is exclusive.
+        """
+        if resolution not in RESOLUTIONS:
+            raise ValueError("Unknown resolution: %s" % resolution)
+        if resolution == RAW:
+            sql = (
+                "SELECT time, service, status, response_microseconds "
+                "FROM status_sample WHERE 1 = 1"
+            )
+            time_column = "time"
+            params = []
+        else:
+            sql = (
+                "SELECT bucket, service, samples, down, latency_samples, "
+                "latency_total, latency_min, latency_max "
+                "FROM status_rollup WHERE resolution = ?"
+            )
+            time_column = "bucket"
+            params = [resolution]
+        if service is not None:
+            sql += " AND service = ?"
+            params.append(service)
+        if start is not None:
+            sql += " AND %s >= ?" % time_column
+            params.append(start)
+        if end is not None:
+            sql += " AND %s < ?" % time_column
+            params.append(end)
+        sql += " ORDER BY %s, service" % time_column
+
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            rows = self._connection.execute(sql, params).fetchall()
+
+        if resolution == RAW:
+            return [dict(zip(RAW_FIELDS, row)) for row in rows]
+        return [{
+            "time": row[0],
+            "service": row[1],
+            "samples": row[2],
+            "down": row[3],
+            "response_microseconds_avg": (
+                row[5] // row[4] if row[4] else None
+            ),
+            "response_microseconds_min": row[6],
+            "response_microseconds_max": row[7],
+        } for row in rows]
+
+
+_recorder = None  # pylint: disable=invalid-name
+_recorder_lock = threading.Lock()  # pylint: disable=invalid-name
+
+
+def get_recorder():
+    """
+    Return the process-wide recorder, starting it on first use, or None if
+    STATUS_HISTORY_DB is not configured.
+    """
+    global _recorder  # pylint: disable=global-statement, invalid-name
+    path = getattr(settings, 'STATUS_HISTORY_DB', None)
+    if not path:
+        return None
+    with _recorder_lock:
+        if _recorder is None or _recorder.path != path:
+            if _recorder is not None:
+                atexit.unregister(_recorder.stop)
+                _recorder.stop()
+            _recorder = StatusRecorder(
+                path,
+                flush_seconds=getattr(
+                    settings, 'STATUS_HISTORY_FLUSH_SECONDS',
+                    DEFAULT_FLUSH_SECONDS,
+                ),
+                retention=getattr(settings, 'STATUS_HISTORY_RETENTION', None),
+            )
+            _recorder.start()
+            atexit.register(_recorder.stop)
+        return _recorder
@@ -0,0 +1,296 @@
+"""
+Tests for the status history recorder.
+"""
+from __future__ import unicode_literals
+
+from io import StringIO
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import mock
+
+from django.core.management import call_command
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.test import Client
+from django.test.testcases import TestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from server_status import recorder
+
+
+class TestStatusRecorder(TestCase):
+    """Test batching, rollups and retention of the recorder."""
+
+    def setUp(self):
+        """Record into a fresh SQLite file for each test."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'history.db')
+        self.recorder = recorder.StatusRecorder(self.path)
+        super(TestStatusRecorder, self).setUp()
+
+    def tearDown(self):
+        """Close the connection and remove the SQLite file."""
+        self.recorder.stop()
+        shutil.rmtree(self.tmpdir)
+        super(TestStatusRecorder, self).tearDown()
+
+    def test_record_is_batched(self):
+        """Nothing is written until the queue is flushed."""
+        self.recorder.record({
+            'postgresql': {'status': 'up', 'response_microseconds': 100},
+            'redis': {'status': 'down'},
+            'status_all': 'down',
+        }, timestamp=1000.0)
+        assert not os.path.exists(self.path)
+        assert self.recorder.flush(now=1000.0) == 3
+        assert self.recorder.flush(now=1000.0) == 0
+
+        rows = self.recorder.query(recorder.RAW)
+        assert [row['service'] for row in rows] == [
+            'postgresql', 'redis', 'status_all',
+        ]
+        assert rows[0]['response_microseconds'] == 100
+        assert rows[1]['response_microseconds'] is None
+
+    def test_flush_batch_size(self):
+        """Each transaction writes at most batch_size samples."""
+        self.recorder.batch_size = 2
+        self.recorder.record({
+            'postgresql': {'status': 'up'},
+            'redis': {'status': 'up'},
+            'status_all': 'up',
+        }, timestamp=1000.0)
+        # pylint: disable=protected-access
+        with mock.patch.object(
+                self.recorder, '_write', wraps=self.recorder._write,
+        ) as mocked:
+            assert self.recorder.flush(now=1000.0) == 3
+        assert [len(call[0][0]) for call in mocked.call_args_list] == [2, 1]
+        assert len(self.recorder.query(recorder.RAW)) == 3
+
+    def test_flush_error(self):
+        """A batch that fails to write is queued again and retried."""
+        self.recorder.record({
+            'postgresql': {'status': 'up'},
+            'status_all': 'up',
+        }, timestamp=1000.0)
+        with mock.patch.object(
+                self.recorder, '_write',
+                side_effect=sqlite3.OperationalError("database is locked"),
+        ):
+            with self.assertRaises(sqlite3.OperationalError):
+                self.recorder.flush(now=1000.0)
+        assert self.recorder.flush(now=1000.0) == 2
+        assert len(self.recorder.query(recorder.RAW)) == 2
+
+    def test_flush_error_overflow(self):
+        """Samples that no longer fit in the queue after a failure are dropped."""
+        small = recorder.StatusRecorder(self.path, max_queue=2)
+        small.record({'redis': {'status': 'up'}}, timestamp=1000.0)
+
+        def fail(samples, now):  # pylint: disable=unused-argument
+            """Fill the queue while the batch is being written, then fail."""
+            small.record({'postgresql': {'status': 'up'}, 'status_all': 'up'})
+            raise sqlite3.OperationalError("database is locked")
+
+        with mock.patch.object(small, '_write', side_effect=fail):
+            with self.assertRaises(sqlite3.OperationalError):
+                small.flush(now=1000.0)
+        assert small.flush(now=1000.0) == 2
+        assert sorted(row['service'] for row in small.query(recorder.RAW)) == [
+            'postgresql', 'status_all',
+        ]
+        small.stop()
+
+    def test_rollups(self):
+        """Samples are folded into minute and hour buckets across batches."""
+        self.recorder.record(
+            {'postgresql': {'status': 'up', 'response_microseconds': 100}},
+            timestamp=1000.0,
+        )
+        self.recorder.record(
+            {'postgresql': {'status': 'up', 'response_microseconds': 300}},
+            timestamp=1030.0,
+        )
+        self.recorder.flush(now=1100.0)
+        self.recorder.record(
+            {'postgresql': {'status': 'down'}}, timestamp=1050.0,
+        )
+        self.recorder.flush(now=1100.0)
+
+        minutes = self.recorder.query(recorder.MINUTE, service='postgresql')
+        assert [row['time'] for row in minutes] == [960, 1020]
+        assert minutes[1]['samples'] == 2
+        assert minutes[1]['down'] == 1
+        assert minutes[1]['response_microseconds_avg'] == 300
+
+        hours = self.recorder.query(recorder.HOUR, service='postgresql')
+        assert len(hours) == 1
+        assert hours[0]['samples'] == 3
+        assert hours[0]['down'] == 1
+        assert hours[0]['response_microseconds_avg'] == 200
+        assert hours[0]['response_microseconds_min'] == 100
+        assert hours[0]['response_microseconds_max'] == 300
+
+        assert len(self.recorder.query(recorder.MINUTE, start=960, end=1020)) == 1
+
+    def test_retention(self):
+        """Each resolution is pruned according to its retention."""
+        self.recorder.retention = {
+            recorder.RAW: 60, recorder.MINUTE: 3600, recorder.HOUR: 86400,
+        }
+        self.recorder.record({'redis': {'status': 'up'}}, timestamp=0.0)
+        self.recorder.flush(now=600.0)
+
+        assert self.recorder.query(recorder.RAW) == []
+        assert len(self.recorder.query(recorder.MINUTE)) == 1
+        assert len(self.recorder.query(recorder.HOUR)) == 1
+
+    def test_full_queue(self):
+        """Results are dropped rather than blocking when the queue is full."""
+        small = recorder.StatusRecorder(self.path, max_queue=3)
+        small.record({'redis': {'status': 'up'}, 'status_all': 'up'})
+        # Only one slot is left, so none of this call is queued.
+        small.record({'redis': {'status': 'up'}, 'status_all': 'up'})
+        assert small.flush() == 2
+        small.stop()
+
+    def test_background_writer(self):
+        """Stopping the writer thread flushes anything still queued."""
+        self.recorder.start()
+        self.recorder.record({'redis': {'status': 'up'}})
+        self.recorder.stop()
+        assert len(self.recorder.query(recorder.RAW)) == 1
+
+    def test_unknown_resolution(self):
+        """Only raw, minute and hour can be queried."""
+        with self.assertRaises(ValueError):
+            self.recorder.query('day')
+
+    def test_export_command(self):
+        """History can be exported as CSV or JSON."""
+        self.recorder.record(
+            {'postgresql': {'status': 'up', 'response_microseconds': 100}},
+            timestamp=1000.0,
+        )
+        self.recorder.flush(now=1000.0)
+
+        with override_settings(STATUS_HISTORY_DB=self.path):
+            out = StringIO()
+            call_command(
+                'export_status_history', '--format', 'json',
+                '--since', '1970-01-01T00:16:00', stdout=out,
+            )
+            rows = json.loads(out.getvalue())
+            assert rows[0]['time'] == '1970-01-01T00:16:00'
+            assert rows[0]['samples'] == 1
+
+            out = StringIO()
+            call_command(
+                'export_status_history', '--resolution', 'raw', stdout=out,
+            )
+            lines = out.getvalue().splitlines()
+            assert lines[0] == 'time,service,status,response_microseconds'
+            assert lines[1] == '1970-01-01T00:16:40.000000,postgresql,up,100'
+
+            out = StringIO()
+            call_command(
+                'export_status_history', '--service', 'missing', stdout=out,
+            )
+            assert out.getvalue().splitlines() == [','.join(recorder.ROLLUP_FIELDS)]
+
+            with self.assertRaises(CommandError):
+                call_command('export_status_history', '--since', 'yesterday')
+
+    def test_export_missing_database(self):
+        """Exporting from a missing file fails without creating it."""
+        with override_settings(STATUS_HISTORY_DB=self.path):
+            with self.assertRaises(CommandError):
+                call_command('export_status_history')
+        missing_dir = os.path.join(self.tmpdir, 'missing', 'history.db')
+        with override_settings(STATUS_HISTORY_DB=missing_dir):
+            with self.assertRaises(CommandError):
+                call_command('export_status_history')
+        assert not os.path.exists(self.path)
+
+    def test_read_only(self):
+        """A read-only recorder does not create or change the file."""
+        reader = recorder.StatusRecorder(self.path, read_only=True)
+        with self.assertRaises(sqlite3.OperationalError):
+            reader.query()
+        reader.stop()
+        assert not os.path.exists(self.path)
+
+    @override_settings(STATUS_HISTORY_DB='')
+    def test_disabled(self):
+        """Recording and exporting require STATUS_HISTORY_DB."""
+        assert recorder.get_recorder() is None
+        with self.assertRaises(CommandError):
+            call_command('export_status_history')
+
+
+@override_settings(HEALTH_CHECK=['CERTIFICATE'])
+class TestGetRecorder(TestCase):
+    """Test the process-wide recorder used by the status view."""
+
+    def setUp(self):
+        """Point STATUS_HISTORY_DB at a fresh SQLite file."""
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'history.db')
+        super(TestGetRecorder, self).setUp()
+
+    def tearDown(self):
+        """Stop the writer thread so it does not leak into other tests."""
+        if recorder._recorder is not None:  # pylint: disable=protected-access
+            recorder._recorder.stop()  # pylint: disable=protected-access
+            recorder._recorder = None  # pylint: disable=protected-access
+        shutil.rmtree(self.tmpdir)
+        super(TestGetRecorder, self).tearDown()
+
+    def test_status_view_records(self):
+        """Calling the status view writes its results to STATUS_HISTORY_DB."""
+        with override_settings(STATUS_HISTORY_DB=self.path):
+            Client().get(
+                reverse("status"), data={"token": settings.STATUS_TOKEN},
+            )
+            history = recorder.get_recorder()
+            history.stop()
+            rows = history.query(recorder.RAW)
+        assert sorted(row['service'] for row in rows) == [
+            'certificate', 'status_all',
+        ]
+
+    def test_settings(self):
+        """The recorder is built from settings, started and reused."""
+        retention = {recorder.RAW: 60}
+        with override_settings(
+                STATUS_HISTORY_DB=self.path,
+                STATUS_HISTORY_FLUSH_SECONDS=1,
+                STATUS_HISTORY_RETENTION=retention,
+        ):
+            history = recorder.get_recorder()
+            assert history.path == self.path
+            assert history.flush_seconds == 1
+            assert history.retention[recorder.RAW] == 60
+            assert history.retention[recorder.HOUR] == (
+                recorder.DEFAULT_RETENTION[recorder.HOUR]
+            )
+            # pylint: disable=protected-access
+            assert history._thread is not None and history._thread.is_alive()
+            assert recorder.get_recorder() is history
+
+    def test_path_change(self):
+        """A new recorder replaces the old one when the path changes."""
+        with override_settings(STATUS_HISTORY_DB=self.path):
+            first = recorder.get_recorder()
+        other_path = os.path.join(self.tmpdir, 'other.db')
+        with override_settings(STATUS_HISTORY_DB=other_path):
+            second = recorder.get_recorder()
+        assert second is not first
+        assert second.path == other_path
+        assert first._thread is None  # pylint: disable=protected-access
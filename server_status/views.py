@@ -9,13 +9,15 @@ Notes:
   UP, DOWN, or NO_CONFIG for the "status" key.
 """
 from __future__ import unicode_literals
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import OpenSSL.crypto
 
 from django.conf import settings
 from django.http import JsonResponse, Http404
 
+from server_status.recorder import get_recorder
+
 log = logging.getLogger(__name__)
 
 UP = "up"
@@ -26,6 +28,11 @@ SERVICE_UNAVAILABLE = 503
 TIMEOUT_SECONDS = 5
 
 
+def microseconds_since(start):
+    """Whole elapsed time since start, in microseconds."""
+    return (datetime.now() - start) // timedelta(microseconds=1)
+
+
 # pylint: disable=too-many-locals, import-outside-toplevel
 def get_pg_info():
     """Check PostgreSQL connection."""
@@ -51,7 +58,7 @@ def get_pg_info():
             port=port, password=password, connect_timeout=TIMEOUT_SECONDS,
         )
         log.debug("at end of context manager")
-        micro = (datetime.now() - start).microseconds
+        micro = microseconds_since(start)
         connection.close()
     except (OperationalError, KeyError) as ex:
         log.error("No PostgreSQL connection info found in settings. Error: %s",
@@ -92,7 +99,7 @@ def get_redis_info():
     except RedisResponseError as ex:
         log.error("Bad Redis response: %s", ex.args)
         return {"status": DOWN, "message": "auth error"}
-    micro = (datetime.now() - start).microseconds
+    micro = microseconds_since(start)
     del rdb  # the redis package does not support Redis's QUIT.
     ret = {
         "status": UP, "response_microseconds": micro,
@@ -119,7 +126,7 @@ def get_elasticsearch_info():
     except ESConnectionError:
         return {"status": DOWN}
     del search  # The elasticsearch library has no "close" or "disconnect."
-    micro = (datetime.now() - start).microseconds
+    micro = microseconds_since(start)
     return {
         "status": UP, "response_microseconds": micro,
     }
@@ -150,7 +157,7 @@ def get_celery_info():
     except Exception as exp:  # pylint: disable=broad-except
         log.error("Error connecting to the backend: %s", exp)
         return {"status": DOWN, "message": "Error connecting to the backend"}
-    return {"status": UP, "response_microseconds": (datetime.now() - start).microseconds}
+    return {"status": UP, "response_microseconds": microseconds_since(start)}
 
 
 def get_certificate_info():
@@ -213,6 +220,10 @@ def status(request):  # pylint: disable=unused-argument
 
     info["status_all"] = status_all
 
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.record(info)
+
     resp = JsonResponse(info)
     resp.status_code = code
     return resp
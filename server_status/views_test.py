@@ -4,6 +4,7 @@ Tests for the status module.
 from __future__ import unicode_literals
 
 from copy import deepcopy
+from datetime import datetime, timedelta
 import json
 import logging
 from freezegun import freeze_time
@@ -221,3 +222,22 @@ class TestStatus(TestCase):
 
         self.assertIn("status_all", resp)
         self.assertEqual(resp["status_all"], views.DOWN)
+
+    @freeze_time("2018-01-14")
+    @override_settings(HEALTH_CHECK=['CERTIFICATE'])
+    def test_status_recorded(self):
+        """
+        Results are handed to the history recorder when one is configured
+        """
+        with mock.patch('server_status.views.get_recorder') as mocked:
+            resp = self.get()
+        mocked.return_value.record.assert_called_once_with(resp)
+
+    def test_microseconds_since(self):
+        """
+        Response times include whole seconds, not just the microsecond part
+        """
+        with freeze_time("2018-01-14") as frozen:
+            start = datetime.now()
+            frozen.tick(timedelta(seconds=5, microseconds=200000))
+            assert views.microseconds_since(start) == 5200000